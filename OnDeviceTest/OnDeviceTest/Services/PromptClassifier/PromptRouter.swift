@@ -78,7 +78,6 @@ class PromptClassifier {
         "contextual_knowledge": [0, 1],
         "number_of_few_shots": [0, 1, 2, 3, 4, 5],
         "domain_knowledge": [3, 1, 2, 0],
-        "no_label_reason": [0],
         "constraint_ct": [1, 0]
     ]
     
@@ -88,7 +87,6 @@ class PromptClassifier {
         "contextual_knowledge": 1,
         "number_of_few_shots": 1,
         "domain_knowledge": 3,
-        "no_label_reason": 1,
         "constraint_ct": 1
     ]
     
@@ -108,6 +106,12 @@ class PromptClassifier {
         11: "Unknown"
     ]
     
+    // Sequence lengths accepted by the CoreML model, read from its input description:
+    // the default build enumerates [16, 32, 64, 128] (EnumeratedShapes in coreml.py),
+    // a --w8a8 build accepts only 128. Attention cost grows with length squared,
+    // so short prompts use a short bucket when the model has one.
+    private let sequenceBuckets: [Int]
+    
     init() async throws {
         // 1. Load the CoreML model with optimized settings
         let config = MLModelConfiguration()
@@ -115,9 +119,11 @@ class PromptClassifier {
         config.computeUnits = .cpuAndNeuralEngine
         
         // Load asynchronously on background thread
-        self.model = try await Task.detached(priority: .userInitiated) {
+        let model = try await Task.detached(priority: .userInitiated) {
             try PromptGrader(configuration: config)
         }.value
+        self.model = model
+        self.sequenceBuckets = PromptClassifier.supportedSequenceLengths(of: model.model)
         
         // 2. Load the custom DeBERTa tokenizer
         self.tokenizer = try DebertaTokenizer()
@@ -127,8 +133,8 @@ class PromptClassifier {
         // 1. Tokenize using our custom DeBERTa tokenizer
         let inputIds = tokenizer.encode(text: prompt)
         
-        // 2. Prepare CoreML Inputs
-        let sequenceLength = 128
+        // 2. Prepare CoreML Inputs, padded to the smallest supported length that fits
+        let sequenceLength = sequenceBuckets.first { $0 >= inputIds.count } ?? sequenceBuckets.last!
         guard let inputIdsArray = try? MLMultiArray(shape: [1, NSNumber(value: sequenceLength)], dataType: .int32),
               let maskArray = try? MLMultiArray(shape: [1, NSNumber(value: sequenceLength)], dataType: .int32) else {
             throw NSError(domain: "PromptClassifier", code: 2, userInfo: [NSLocalizedDescriptionKey: "Failed to create MLMultiArrays"])
@@ -171,6 +177,18 @@ class PromptClassifier {
         )
     }
     
+    /// Sequence lengths the model accepts for input_ids, shortest first (falls back to 128)
+    private static func supportedSequenceLengths(of model: MLModel) -> [Int] {
+        guard let constraint = model.modelDescription.inputDescriptionsByName["input_ids"]?.multiArrayConstraint else {
+            return [128]
+        }
+        let shapes = constraint.shapeConstraint.type == .enumerated
+            ? constraint.shapeConstraint.enumeratedShapes
+            : [constraint.shape]
+        let lengths = shapes.compactMap { $0.last?.intValue }.sorted()
+        return lengths.isEmpty ? [128] : lengths
+    }
+    
     /// Helper to compute weighted score from logits
     private func computeScore(logits: MLMultiArray, target: String) -> Double {
         // 1. Softmax
@@ -19,7 +19,7 @@ Classification Heads (8 outputs):
   3. contextual_knowledge- 2 classes (Required, Not Required)
   4. number_of_few_shots - 6 classes (0-5 examples needed)
   5. domain_knowledge    - 4 classes (Expert, Intermediate, Basic, None)
-  6. no_label_reason     - 1 class (internal use)
+  6. no_label_reason     - 1 class (internal use, not exported)
   7. constraint_ct       - 2 classes (Has Constraints, No Constraints)
 
 === CONVERSION CHALLENGES ===
@@ -33,8 +33,10 @@ tracing. This script patches two problematic functions:
 === OUTPUT ===
 
 The script produces a .mlpackage file that:
-- Takes input_ids and attention_mask as inputs (shape: [1, 128])
-- Returns 8 separate logit tensors (raw, unnormalized scores)
+- Takes input_ids and attention_mask as inputs (shape: [1, 16|32|64|128])
+- Returns 7 separate logit tensors (raw, unnormalized scores);
+  the internal no_label_reason head is pruned at export
+- Runs in FP16 with palettized weights (4-bit embedding, 6-bit linear), iOS 17+
 - Post-processing (softmax, score computation) is done in Swift
 
 === USAGE ===
@@ -44,9 +46,12 @@ Prerequisites:
 
 Run:
     python coreml.py
+    python coreml.py --compression int8                        # int8 weights instead
+    python coreml.py --w8a8 [--calibration-file prompts.txt]  # int8 activations
 
 Output:
     PromptGrader.mlpackage (copy to Xcode project)
+    classifier_metadata.json (weights/divisors for score computation)
 
 === POST-PROCESSING (Swift) ===
 
@@ -61,11 +66,15 @@ Author: Converted for on-device inference
 License: Subject to NVIDIA's model license
 """
 
+import os
+import sys
+import json
+import math
+import argparse
+import numpy as np
 import torch
 import torch.nn as nn
 from transformers import AutoModel, AutoTokenizer, AutoConfig
-import coremltools
-from transformers.models.deberta_v2 import modeling_deberta_v2
 
 # ============================================
 # DeBERTa Compatibility Patches
@@ -73,22 +82,25 @@ from transformers.models.deberta_v2 import modeling_deberta_v2
 # 
 # DeBERTa uses @torch.jit.script decorated functions that cause issues
 # during CoreML conversion. We replace them with pure Python equivalents.
+# Patches are applied on first model construction (not at import time).
 
 def safe_scaled_size_sqrt(query_layer, scale_factor):
     """
     Replacement for DeBERTa's scaled_size_sqrt function.
     
     Original uses dynamic tensor operations that fail during JIT tracing.
-    This version explicitly creates a float tensor for the sqrt operation.
+    The head dimension is fixed, so the sqrt is computed in Python and
+    traced as a constant (no sqrt op in the CoreML graph).
     
     Args:
         query_layer: Query tensor from attention layer
         scale_factor: Scaling factor for attention scores
     
     Returns:
-        Square root of (query dimension * scale factor)
+        0-dim tensor: square root of (query dimension * scale factor).
+        A tensor (not a float) because DeBERTa calls .to(dtype=...) on it.
     """
-    return torch.sqrt(torch.tensor(query_layer.size(-1), dtype=torch.float) * scale_factor)
+    return torch.tensor(math.sqrt(query_layer.size(-1) * scale_factor), dtype=torch.float)
 
 
 def safe_build_rpos(query_layer, key_layer, relative_pos, position_buckets, max_relative_positions):
@@ -109,6 +121,8 @@ def safe_build_rpos(query_layer, key_layer, relative_pos, position_buckets, max_
     Returns:
         Relative position tensor for attention computation
     """
+    from transformers.models.deberta_v2 import modeling_deberta_v2
+    
     if key_layer.size(-2) != query_layer.size(-2):
         # Cross-attention case: rebuild relative positions
         return modeling_deberta_v2.build_relative_position(
@@ -122,10 +136,12 @@ def safe_build_rpos(query_layer, key_layer, relative_pos, position_buckets, max_
         return relative_pos
 
 
-# Apply patches to DeBERTa module
-modeling_deberta_v2.scaled_size_sqrt = safe_scaled_size_sqrt
-modeling_deberta_v2.build_rpos = safe_build_rpos
-print("✅ Patched DeBERTa functions for CoreML compatibility.")
+def _apply_deberta_patches():
+    """Installs the patched functions into DeBERTa's module (idempotent)."""
+    from transformers.models.deberta_v2 import modeling_deberta_v2
+    
+    modeling_deberta_v2.scaled_size_sqrt = safe_scaled_size_sqrt
+    modeling_deberta_v2.build_rpos = safe_build_rpos
 
 
 # ============================================
@@ -148,22 +164,17 @@ class MeanPooling(nn.Module):
         super(MeanPooling, self).__init__()
 
     def forward(self, last_hidden_state, attention_mask):
-        # Expand mask to match hidden state dimensions
-        # [batch, seq_len] -> [batch, seq_len, hidden_dim]
-        input_mask_expanded = (
-            attention_mask.unsqueeze(-1).expand(last_hidden_state.size()).float()
-        )
-        
         # Sum embeddings, weighted by mask (zeros out padding)
-        sum_embeddings = torch.sum(last_hidden_state * input_mask_expanded, 1)
+        # [batch, seq_len, 1] broadcasts over hidden_dim without an expanded copy;
+        # an integer mask is promoted to the hidden state dtype by the multiply
+        sum_embeddings = (last_hidden_state * attention_mask.unsqueeze(-1)).sum(1)
         
-        # Count non-padding tokens
-        sum_mask = input_mask_expanded.sum(1)
-        sum_mask = torch.clamp(sum_mask, min=1e-9)  # Avoid division by zero
+        # Count non-padding tokens: [batch, 1]
+        sum_mask = attention_mask.sum(1, keepdim=True).to(last_hidden_state.dtype)
+        sum_mask = sum_mask.clamp_min(1e-9)  # Avoid division by zero
         
         # Compute mean
-        mean_embeddings = sum_embeddings / sum_mask
-        return mean_embeddings
+        return sum_embeddings / sum_mask
 
 
 class MulticlassHead(nn.Module):
@@ -188,6 +199,11 @@ class MulticlassHead(nn.Module):
 # Main Model Class
 # ============================================
 
+# Heads left out of the exported model. no_label_reason is internal-only and
+# not used by the Swift post-processing.
+PRUNED_HEADS = ("no_label_reason",)
+
+
 class OriginalCustomModel(nn.Module):
     """
     NVIDIA Prompt Classifier model adapted for CoreML export.
@@ -195,7 +211,8 @@ class OriginalCustomModel(nn.Module):
     Architecture:
     1. DeBERTa-v3-base backbone (12 layers, 768 hidden dim)
     2. Mean pooling layer
-    3. 8 separate classification heads
+    3. 8 classification heads, fused into a single Linear for inference
+       (no_label_reason is loaded but left out of the outputs)
     
     The forward pass returns raw logits only (no softmax/post-processing).
     Post-processing is handled in Swift for better CoreML compatibility.
@@ -211,136 +228,619 @@ class OriginalCustomModel(nn.Module):
     - constraint_ct: 2 classes
     """
     
-    def __init__(self, target_sizes, task_type_map, weights_map, divisor_map):
+    def __init__(self, target_sizes):
         super(OriginalCustomModel, self).__init__()
+        _apply_deberta_patches()
         
-        # Load DeBERTa backbone
-        self.backbone = AutoModel.from_pretrained("microsoft/deberta-v3-base")
-        self.target_sizes = target_sizes.values()
+        # Build DeBERTa backbone from config only (random init, no weight download);
+        # load_state_dict overwrites every backbone weight from the checkpoint
+        backbone_config = AutoConfig.from_pretrained("microsoft/deberta-v3-base")
+        self.backbone = AutoModel.from_config(backbone_config)
+        self.target_sizes = tuple(target_sizes.values())
+        
+        # Heads included in the model outputs (indices into target_sizes)
+        self.output_heads = tuple(
+            i for i, name in enumerate(target_sizes) if name not in PRUNED_HEADS
+        )
+        self.output_sizes = tuple(self.target_sizes[i] for i in self.output_heads)
         
         # Create classification heads (one per output)
-        # Using add_module to match original weight key names (head_0, head_1, etc.)
-        self.heads = [
+        # Original checkpoint keys (head_0.*, head_1.*) are renamed to
+        # heads.0.*, heads.1.* on load (see _load_from_state_dict)
+        self.heads = nn.ModuleList([
             MulticlassHead(self.backbone.config.hidden_size, sz) 
             for sz in self.target_sizes
-        ]
-        for i, head in enumerate(self.heads):
-            self.add_module(f"head_{i}", head)
+        ])
+        
+        # All output heads as one [hidden, sum(output_sizes)] Linear: one GEMM
+        # instead of one per head. The per-head modules are kept for checkpoint
+        # loading only.
+        self.fused_head = nn.Linear(
+            self.backbone.config.hidden_size, sum(self.output_sizes)
+        )
         
         self.pool = MeanPooling()
 
+    def _load_from_state_dict(self, state_dict, prefix, *args, **kwargs):
+        # Map original checkpoint keys: head_0.fc.weight -> heads.0.fc.weight
+        legacy_prefix = prefix + "head_"
+        for key in [k for k in state_dict if k.startswith(legacy_prefix)]:
+            new_key = prefix + "heads." + key[len(legacy_prefix):]
+            state_dict[new_key] = state_dict.pop(key)
+        super()._load_from_state_dict(state_dict, prefix, *args, **kwargs)
+
+    def fuse_heads(self):
+        """
+        Copies the output heads' weights into fused_head.
+        
+        Must be called after loading pretrained weights, since the
+        checkpoint only contains per-head (head_i.fc.*) keys.
+        """
+        output_heads = [self.heads[i] for i in self.output_heads]
+        with torch.no_grad():
+            self.fused_head.weight.copy_(
+                torch.cat([head.fc.weight for head in output_heads], dim=0)
+            )
+            self.fused_head.bias.copy_(
+                torch.cat([head.fc.bias for head in output_heads], dim=0)
+            )
+
     def forward(self, input_ids, attention_mask):
         """
-        Forward pass returning raw logits for all 8 heads.
+        Forward pass returning raw logits for the output heads.
         
         Args:
             input_ids: Token IDs [batch, seq_len]
             attention_mask: Attention mask [batch, seq_len]
         
         Returns:
-            Tuple of 8 logit tensors, one per classification head
+            Tuple of 7 logit tensors, one per output head (in head order)
         """
-        # Cast mask to float for DeBERTa compatibility
-        attention_mask_float = attention_mask.to(dtype=torch.float32)
-        
-        # Get transformer outputs
+        # Get transformer outputs (DeBERTa casts the integer mask internally,
+        # so no FP32 mask is carried through the graph)
         outputs = self.backbone(
             input_ids=input_ids, 
-            attention_mask=attention_mask_float
+            attention_mask=attention_mask
         )
         last_hidden_state = outputs.last_hidden_state
         
         # Pool to single vector per sequence
-        mean_pooled_representation = self.pool(last_hidden_state, attention_mask_float)
-        
-        # Get logits from each head
-        logits = []
-        for i in range(len(self.target_sizes)):
-            head = getattr(self, f"head_{i}")
-            logits.append(head(mean_pooled_representation))
+        mean_pooled_representation = self.pool(last_hidden_state, attention_mask)
         
-        return tuple(logits)
+        # Run all heads at once, then split into per-head logits (in head order)
+        fused = self.fused_head(mean_pooled_representation)
+        return tuple(torch.split(fused, list(self.output_sizes), dim=-1))
 
 
 # ============================================
-# Main Conversion Script
+# Weight Download
 # ============================================
 
-def main():
+# Local Hugging Face cache for checkpoint files
+HF_CACHE_DIR = "./.cache/hf"
+
+# Traced TorchScript modules, reused across conversion runs
+TRACE_CACHE_DIR = "./.cache"
+
+
+def cached_download(model_id, filename):
     """
-    Main conversion pipeline:
-    1. Load model configuration from Hugging Face
-    2. Initialize model architecture
-    3. Download and load pretrained weights
-    4. Trace model with sample input
-    5. Convert to CoreML format
-    6. Save .mlpackage file
+    Returns a local path to a Hub file, downloading only on a cache miss.
+    
+    A cache hit does not check the Hub for a newer revision; delete
+    ./.cache/hf to pick one up (the trace cache then misses on its own).
+    
+    Args:
+        model_id: Hugging Face repo ID
+        filename: File within the repo
+    
+    Returns:
+        Path to the cached file
     """
+    from huggingface_hub import hf_hub_download, try_to_load_from_cache
     
-    model_id = "nvidia/prompt-task-and-complexity-classifier"
+    cached_path = try_to_load_from_cache(
+        repo_id=model_id, filename=filename, cache_dir=HF_CACHE_DIR
+    )
+    if isinstance(cached_path, str):
+        return cached_path
+    return hf_hub_download(repo_id=model_id, filename=filename, cache_dir=HF_CACHE_DIR)
+
+
+# ============================================
+# Input Shapes
+# ============================================
+
+# Sequence lengths the converted model accepts. Swift pads each prompt to
+# the smallest bucket that fits (see PromptRouter.swift).
+SEQUENCE_BUCKETS = (16, 32, 64, 128)
+
+
+# ============================================
+# Activation Quantization (W8A8)
+# ============================================
+
+# Representative prompts for collecting activation ranges.
+# Pass --calibration-file with one prompt per line for a larger set (~200 recommended).
+CALIBRATION_PROMPTS = [
+    "Explain the theory of relativity.",
+    "Write a Python function to sort a list.",
+    "Summarize the following article in three sentences.",
+    "Brainstorm ten names for a coffee shop.",
+    "What is the capital of France?",
+    "Rewrite this paragraph to sound more formal.",
+    "Classify the sentiment of this review: the food was cold.",
+    "Extract all dates mentioned in the text below.",
+    "Write a short poem about the ocean at night.",
+    "Hi there! How are you doing today?",
+    "Translate 'good morning' into Spanish and German.",
+    "Design a database schema for a library management system.",
+    "Prove that the square root of two is irrational.",
+    "Given these three examples, label the fourth one in the same style.",
+    "Write a cover letter for a senior software engineer position in under 200 words.",
+    "Compare the economic policies of Keynes and Hayek.",
+]
+
+# Held-out prompts for top-1 agreement (never used for calibration, which
+# would overstate agreement)
+EVALUATION_PROMPTS = [
+    "Describe how photosynthesis works.",
+    "Write a JavaScript function that debounces another function.",
+    "Give me a one-paragraph summary of the French Revolution.",
+    "List five ideas for a team-building activity.",
+    "Who wrote Pride and Prejudice?",
+    "Make this email sound friendlier.",
+    "Is this tweet positive or negative: my flight got delayed again.",
+    "Pull out every email address from the message below.",
+    "Write a haiku about autumn leaves.",
+    "Good evening! What should I cook tonight?",
+    "Convert this SQL query to use a JOIN instead of a subquery.",
+    "Explain why the halting problem is undecidable.",
+    "Using the two examples above, write a third product description.",
+    "Draft a resignation letter that is polite and brief.",
+    "What are the trade-offs between microservices and a monolith?",
+    "Plan a three-day itinerary for Kyoto on a small budget.",
+]
+
+
+def load_calibration_prompts(path=None):
+    """
+    Returns the prompts used to calibrate activation ranges.
     
-    # Step 1: Load configuration
-    print(f"📋 Loading config for {model_id}...")
-    config = AutoConfig.from_pretrained(model_id)
+    Args:
+        path: Optional text file with one prompt per line
     
-    print("   Target sizes:", dict(config.target_sizes))
-    print("   Task types:", len(config.task_type_map), "classes")
+    Returns:
+        List of prompt strings
+    """
+    if path is None:
+        return CALIBRATION_PROMPTS
+    with open(path) as f:
+        return [line.strip() for line in f if line.strip()]
+
+
+def quantize_activations(model, tokenizer, sample_inputs, prompts):
+    """
+    Applies W8A8 static quantization using the PT2E CoreMLQuantizer flow.
+    
+    Inserts quantize/dequantize ops around every Linear (encoder and
+    classification heads), calibrates activation min/max on the given
+    prompts, and returns an ExportedProgram ready for coremltools.convert.
+    
+    Args:
+        model: OriginalCustomModel in eval mode
+        tokenizer: Tokenizer used to encode calibration prompts
+        sample_inputs: (input_ids, attention_mask) example tuple
+        prompts: Calibration prompts
+    
+    Returns:
+        torch.export.ExportedProgram of the quantized model
+    """
+    from torch.ao.quantization.quantize_pt2e import prepare_pt2e, convert_pt2e
+    from coremltools.optimize.torch.quantization.quantization_config import (
+        LinearQuantizerConfig,
+    )
+    from coremltools.optimize.torch.quantization._coreml_quantizer import (
+        CoreMLQuantizer,
+    )
+    
+    config = LinearQuantizerConfig.from_dict({
+        "global_config": {
+            "quantization_scheme": "symmetric",
+            "milestones": [0, 0, 10, 10],
+            "activation_dtype": torch.quint8,
+            "weight_dtype": torch.qint8,
+            "weight_per_channel": True,
+        }
+    })
+    quantizer = CoreMLQuantizer(config)
+    
+    exported_model = torch.export.export_for_training(model, sample_inputs).module()
+    prepared_model = prepare_pt2e(exported_model, quantizer)
+    
+    # Calibrate: observers record activation ranges
+    with torch.no_grad():
+        for prompt in prompts:
+            encoded = tokenizer(
+                prompt,
+                return_tensors="pt",
+                max_length=sample_inputs[0].shape[-1],
+                padding="max_length",
+                truncation=True
+            )
+            prepared_model(encoded["input_ids"], encoded["attention_mask"])
+    
+    quantized_model = convert_pt2e(prepared_model)
+    return torch.export.export(quantized_model, sample_inputs)
+
+
+# ============================================
+# Validation Helpers
+# ============================================
+
+def compute_psnr(reference, test):
+    """
+    Peak signal-to-noise ratio between reference and test outputs.
+    
+    Used to check that FP16 compute and weight compression did not
+    noticeably change the logits. Values above ~40 dB are a close match.
+    
+    Args:
+        reference: PyTorch output (numpy array)
+        test: CoreML output (numpy array)
+    
+    Returns:
+        PSNR in decibels
+    """
+    reference = reference.astype(np.float32).flatten()
+    test = test.astype(np.float32).flatten()
+    mse = np.mean((reference - test) ** 2)
+    if mse == 0:
+        return float("inf")
+    peak = np.max(np.abs(reference))
+    return 20 * np.log10(peak / np.sqrt(mse))
+
+
+def top1_agreement(model, mlmodel, tokenizer, prompts, output_names, max_length,
+                   sequence_length=None):
+    """
+    Fraction of prompts where PyTorch and CoreML pick the same top class.
+    
+    PSNR on one sample can hide argmax flips after weight compression;
+    this checks the decision each head actually makes.
+    
+    Args:
+        model: Reference PyTorch model (or traced module)
+        mlmodel: Converted coremltools MLModel
+        tokenizer: Tokenizer for the prompts
+        prompts: Held-out prompts (must fit in sequence_length tokens)
+        output_names: CoreML output names, in model output order
+        max_length: Padded sequence length for the PyTorch reference
+        sequence_length: Padded sequence length for CoreML (defaults to max_length)
+    
+    Returns:
+        Dict mapping output name -> agreement in [0, 1]
+    """
+    sequence_length = sequence_length or max_length
+    matches = {name: 0 for name in output_names}
+    for prompt in prompts:
+        encoded = tokenizer(
+            prompt,
+            return_tensors="pt",
+            max_length=max_length,
+            padding="max_length",
+            truncation=True
+        )
+        with torch.no_grad():
+            torch_outputs = model(encoded["input_ids"], encoded["attention_mask"])
+        # Padding only to the bucket must not change the logits
+        coreml_predictions = mlmodel.predict({
+            "input_ids": encoded["input_ids"][:, :sequence_length].numpy().astype(np.int32),
+            "attention_mask": encoded["attention_mask"][:, :sequence_length].numpy().astype(np.int32),
+        })
+        for name, pt_out in zip(output_names, torch_outputs):
+            if pt_out.argmax().item() == int(np.argmax(coreml_predictions[name])):
+                matches[name] += 1
+    return {name: count / len(prompts) for name, count in matches.items()}
+
+
+def count_mil_ops(mlmodel):
+    """
+    Counts ops by type in the converted MIL program (including nested blocks).
+    
+    Args:
+        mlmodel: Converted coremltools MLModel (ML Program)
+    
+    Returns:
+        Dict mapping op type -> count
+    """
+    from collections import Counter
+    
+    function = mlmodel._spec.mlProgram.functions["main"]
+    op_counts = Counter()
+    
+    def visit(block):
+        for op in block.operations:
+            op_counts[op.type] += 1
+            for inner_block in op.blocks:
+                visit(inner_block)
     
-    # Step 2: Download pretrained weights
+    visit(function.block_specializations[function.opset])
+    return dict(op_counts)
+
+
+def count_fp16_dequantize(mlmodel):
+    """
+    Counts dequantize ops whose output feeds anything other than a linear/matmul.
+    
+    In a W8A8 ML Program every activation is stored as a quantize -> dequantize
+    pair feeding a linear/matmul, which the runtime fuses into an int8 op. A
+    dequantize consumed by any other op (add, layer_norm, softmax, a block
+    output, ...) leaves that activation in FP16 between ops.
+    
+    Args:
+        mlmodel: Converted coremltools MLModel (ML Program)
+    
+    Returns:
+        Number of dequantize ops with a non-linear/matmul consumer
+    """
+    from collections import defaultdict
+    
+    function = mlmodel._spec.mlProgram.functions["main"]
+    consumers = defaultdict(set)  # variable name -> consuming op types
+    dequantize_outputs = []
+    
+    def visit(block):
+        for op in block.operations:
+            if op.type == "dequantize":
+                dequantize_outputs.extend(output.name for output in op.outputs)
+            for argument in op.inputs.values():
+                for binding in argument.arguments:
+                    if binding.name:
+                        consumers[binding.name].add(op.type)
+            for inner_block in op.blocks:
+                visit(inner_block)
+        for name in block.outputs:
+            consumers[name].add("block_output")
+    
+    visit(function.block_specializations[function.opset])
+    return sum(
+        1 for name in dequantize_outputs
+        if consumers[name] - {"linear", "matmul"}
+    )
+
+
+def report_compute_devices(mlmodel):
+    """
+    Reports which ops CoreML will not place on the Neural Engine.
+    
+    Uses MLComputePlan (macOS 14.4+) to query the preferred compute device
+    of every op in the compiled model under CPU_AND_NE.
+    
+    Args:
+        mlmodel: Converted coremltools MLModel
+    
+    Returns:
+        Dict mapping op type -> count of ops that fall back off the ANE
+    """
+    from collections import Counter
+    import coremltools
+    from coremltools.models.compute_plan import MLComputePlan
+    from coremltools.models.compute_device import MLNeuralEngineComputeDevice
+    
+    compute_plan = MLComputePlan.load_from_path(
+        path=mlmodel.get_compiled_model_path(),
+        compute_units=coremltools.ComputeUnit.CPU_AND_NE,
+    )
+    main_function = compute_plan.model_structure.program.functions["main"]
+    
+    fallback_ops = Counter()
+    for operation in main_function.block.operations:
+        usage = compute_plan.get_compute_device_usage_for_mlprogram_operation(operation)
+        if usage is None:
+            continue  # const ops have no device assignment
+        if not isinstance(usage.preferred_compute_device, MLNeuralEngineComputeDevice):
+            fallback_ops[operation.operator_name] += 1
+    return dict(fallback_ops)
+
+
+# ============================================
+# Main Conversion Script
+# ============================================
+
+def load_model(model_id, config):
+    """
+    Builds OriginalCustomModel and loads the pretrained classifier weights.
+    
+    Args:
+        model_id: Hugging Face repo ID of the classifier
+        config: Classifier config (provides target_sizes)
+    
+    Returns:
+        Model in eval mode with fused heads
+    """
     print("\n📥 Downloading weights...")
-    from huggingface_hub import hf_hub_download
     from safetensors.torch import load_file
     
     try:
         # Try safetensors format first (smaller, faster)
-        model_file = hf_hub_download(repo_id=model_id, filename="model.safetensors")
+        model_file = cached_download(model_id, "model.safetensors")
+    except Exception:
+        model_file = None
+    
+    if model_file is not None:
         state_dict = load_file(model_file)
         print("   Loaded from model.safetensors")
-    except Exception:
-        # Fall back to PyTorch bin format
+    else:
+        # Fall back to PyTorch bin format (memory-mapped)
         print("   Safetensors not found, trying pytorch_model.bin...")
-        model_file = hf_hub_download(repo_id=model_id, filename="pytorch_model.bin")
-        state_dict = torch.load(model_file, map_location="cpu")
+        model_file = cached_download(model_id, "pytorch_model.bin")
+        state_dict = torch.load(model_file, map_location="cpu", mmap=True, weights_only=True)
     
-    # Step 3: Initialize model and load weights
     print("\n🔧 Initializing model...")
-    model = OriginalCustomModel(
-        target_sizes=config.target_sizes,
-        task_type_map=config.task_type_map,
-        weights_map=config.weights_map,
-        divisor_map=config.divisor_map,
-    )
+    model = OriginalCustomModel(target_sizes=config.target_sizes)
     
-    # Load weights (strict=False for potential buffer mismatches)
-    model.load_state_dict(state_dict, strict=False)
+    # Load weights (strict=False for potential buffer mismatches). The backbone
+    # starts from random weights, so every checkpoint key must be present;
+    # only fused_head is filled afterwards (by fuse_heads). assign=True makes
+    # the checkpoint tensors the parameters instead of copying them, so a
+    # memory-mapped .bin stays mmap-backed
+    result = model.load_state_dict(state_dict, strict=False, assign=True)
+    missing = [key for key in result.missing_keys if not key.startswith("fused_head.")]
+    if missing:
+        raise RuntimeError(
+            f"Checkpoint is missing {len(missing)} weight(s), e.g. {missing[:5]}"
+        )
+    if result.unexpected_keys:
+        print(f"   ⚠️ Unexpected keys: {result.unexpected_keys}")
+    model.fuse_heads()
     model.eval()
     print("   Model loaded successfully")
+    return model
+
+
+def traced_cache_path(model_id, seq_len):
+    """
+    Returns the cache path for a traced TorchScript module.
+    
+    The key covers everything that changes the traced module (which also
+    holds the weights): the checkpoint revision, sequence length,
+    torch/transformers versions, and this script's source.
+    
+    Args:
+        model_id: Hugging Face repo ID of the classifier
+        seq_len: Sequence length used for tracing
+    
+    Returns:
+        Path like ./.cache/traced_<key>.pt, or None if no checkpoint is
+        cached locally yet (nothing to reuse)
+    """
+    import hashlib
+    import transformers
+    from huggingface_hub import try_to_load_from_cache
+    
+    # The resolved snapshot path contains the commit hash of the checkpoint
+    checkpoint_path = None
+    for filename in ("model.safetensors", "pytorch_model.bin"):
+        cached_path = try_to_load_from_cache(
+            repo_id=model_id, filename=filename, cache_dir=HF_CACHE_DIR
+        )
+        if isinstance(cached_path, str):
+            checkpoint_path = cached_path
+            break
+    if checkpoint_path is None:
+        return None
+    
+    with open(__file__, "rb") as f:
+        script_source = f.read()
+    key_source = (
+        model_id + os.path.relpath(checkpoint_path, HF_CACHE_DIR) + str(seq_len)
+        + torch.__version__ + transformers.__version__
+    )
+    key = hashlib.sha256(key_source.encode() + script_source).hexdigest()[:16]
+    return os.path.join(TRACE_CACHE_DIR, f"traced_{key}.pt")
+
+
+def main():
+    """
+    Main conversion pipeline:
+    1. Load model configuration from Hugging Face
+    2. Prepare tokenizer and sample input
+    3. Download weights and initialize model (skipped on a trace cache hit)
+    4. Trace model with sample input (or W8A8-quantize and export)
+    5. Convert to CoreML format (FP16 compute precision)
+    6. Compress weights: palettize or int8 (skipped for W8A8, already quantized)
+    7. Save .mlpackage file
+    8. Validate against PyTorch (PSNR) and check ANE placement (best-effort)
+    """
+    parser = argparse.ArgumentParser(description="Convert prompt classifier to CoreML")
+    parser.add_argument(
+        "--w8a8",
+        action="store_true",
+        help="Quantize weights and activations to int8 via the PT2E CoreMLQuantizer flow",
+    )
+    parser.add_argument(
+        "--calibration-file",
+        help="Text file with one calibration prompt per line (used with --w8a8)",
+    )
+    parser.add_argument(
+        "--compression",
+        choices=["palettize", "int8"],
+        default="palettize",
+        help="Weight compression: k-means palettization (default) or int8 linear quantization",
+    )
+    parser.add_argument(
+        "--retrace",
+        action="store_true",
+        help="Ignore the cached TorchScript trace and trace again "
+             "(the cache is keyed on the locally cached checkpoint revision)",
+    )
+    args = parser.parse_args()
+    
+    model_id = "nvidia/prompt-task-and-complexity-classifier"
+    
+    # Also applied by OriginalCustomModel; repeated calls are harmless
+    _apply_deberta_patches()
+    print("✅ Patched DeBERTa functions for CoreML compatibility.")
+    
+    # Step 1: Load configuration
+    print(f"📋 Loading config for {model_id}...")
+    config = AutoConfig.from_pretrained(model_id)
+    
+    print("   Target sizes:", dict(config.target_sizes))
+    print("   Task types:", len(config.task_type_map), "classes")
     
-    # Step 4: Prepare tokenizer and sample input
+    # Step 2: Prepare tokenizer and sample input
     print("\n📝 Preparing sample input...")
     tokenizer = AutoTokenizer.from_pretrained(model_id)
     
+    # Trace at the largest bucket; shorter buckets are enumerated at convert time
+    max_length = SEQUENCE_BUCKETS[-1]
     sample_text = "Explain the theory of relativity."
     inputs = tokenizer(
         sample_text, 
         return_tensors="pt", 
-        max_length=128, 
+        max_length=max_length, 
         padding="max_length", 
         truncation=True
     )
     print(f"   Sample: '{sample_text}'")
     print(f"   Input shape: {inputs['input_ids'].shape}")
     
-    # Step 5: Trace model with JIT
-    print("\n🔍 Tracing model with TorchScript...")
-    traced_model = torch.jit.trace(
-        model, 
-        (inputs["input_ids"], inputs["attention_mask"])
-    )
-    print("   Tracing successful")
+    sample_inputs = (inputs["input_ids"], inputs["attention_mask"])
+    cache_path = traced_cache_path(model_id, max_length)
     
-    # Step 6: Convert to CoreML
+    if args.w8a8:
+        # Step 3: Load model and weights
+        model = load_model(model_id, config)
+        
+        # Step 4: Quantize weights + activations and export
+        prompts = load_calibration_prompts(args.calibration_file)
+        print(f"\n🎯 Quantizing activations (W8A8, {len(prompts)} calibration prompts)...")
+        source_model = quantize_activations(model, tokenizer, sample_inputs, prompts)
+        print("   Quantization successful")
+    elif cache_path is not None and os.path.exists(cache_path) and not args.retrace:
+        # Steps 3-4: Reuse the traced module from a previous run
+        print(f"\n♻️  Loading cached trace from {cache_path}...")
+        model = torch.jit.load(cache_path)
+        model.eval()
+        source_model = model
+    else:
+        # Step 3: Load model and weights
+        model = load_model(model_id, config)
+        
+        # Step 4: Trace model with JIT
+        print("\n🔍 Tracing model with TorchScript...")
+        source_model = torch.jit.trace(model, sample_inputs)
+        # Keyed on the checkpoint revision just loaded
+        cache_path = traced_cache_path(model_id, max_length)
+        os.makedirs(TRACE_CACHE_DIR, exist_ok=True)
+        source_model.save(cache_path)
+        print(f"   Tracing successful (cached to {cache_path})")
+    
+    # Step 5: Convert to CoreML
     print("\n🍎 Converting to CoreML...")
+    import coremltools
     
     # Define output names for each classification head
     output_names = [
@@ -350,47 +850,210 @@ def main():
         "logits_contextual_knowledge", # Head 3: Context required
         "logits_few_shots",            # Head 4: Few-shot examples needed
         "logits_domain_knowledge",     # Head 5: Domain expertise needed
-        "logits_no_label_reason",      # Head 6: Internal use
+        # Head 6 (no_label_reason) is pruned: internal use only
         "logits_constraint_ct"         # Head 7: Has constraints
     ]
     
     coreml_outputs = [coremltools.TensorType(name=name) for name in output_names]
     
+    # Accept a fixed set of sequence lengths so short prompts skip most of the
+    # O(L²) attention cost. The caller pads to the smallest bucket that fits.
+    # (The W8A8 ExportedProgram is exported at a static length, so it keeps [1, 128];
+    # PromptRouter reads the accepted shapes from the model, so it pads to 128 then.)
+    if args.w8a8:
+        input_shape = inputs["input_ids"].shape
+    else:
+        input_shape = coremltools.EnumeratedShapes(
+            shapes=[(1, length) for length in SEQUENCE_BUCKETS],
+            default=(1, max_length),
+        )
+    
     mlmodel = coremltools.convert(
-        traced_model,
+        source_model,
         inputs=[
             coremltools.TensorType(
                 name="input_ids", 
-                shape=inputs["input_ids"].shape, 
+                shape=input_shape, 
                 dtype=int
             ),
             coremltools.TensorType(
                 name="attention_mask", 
-                shape=inputs["attention_mask"].shape, 
+                shape=input_shape, 
                 dtype=int
             )
         ],
         outputs=coreml_outputs,
-        minimum_deployment_target=coremltools.target.iOS16  # Requires iOS 16+
+        # Keep the encoder on the Neural Engine (CPU only for unsupported ops)
+        compute_units=coremltools.ComputeUnit.CPU_AND_NE,
+        # FP16 weights + activations: half the bytes per layer, runs natively on ANE/GPU
+        compute_precision=coremltools.precision.FLOAT16,
+        minimum_deployment_target=coremltools.target.iOS17,  # Requires iOS 17+ (compressed ops)
+        # All default graph passes, stated explicitly. Relevant here:
+        # fuse_layernorm_or_instancenorm folds decomposed mean/var/normalize
+        # chains into single layer_norm ops; fuse_linear_bias, fuse_matmul_weight_bias,
+        # and the const-elimination passes clean up around them.
+        pass_pipeline=coremltools.PassPipeline.DEFAULT,
     )
     
+    # LayerNorm is a data-dependent normalization, so it cannot fold into the
+    # preceding linear; the win is one fused layer_norm op instead of a
+    # reduce_mean/sub/mul/rsqrt chain (one memory pass over the activations)
+    op_counts = count_mil_ops(mlmodel)
+    print(f"   layer_norm ops: {op_counts.get('layer_norm', 0)}")
+    if op_counts.get("reduce_mean", 0):
+        print(f"   ⚠️ {op_counts['reduce_mean']} reduce_mean op(s) left: some normalization was not fused")
+    
+    # Step 6: Compress weights
+    if args.w8a8:
+        # W8A8 models already carry int8 weights from the PT2E flow.
+        # quantize -> dequantize -> linear/matmul pairs are expected (the
+        # runtime fuses them); a dequantize feeding any other op means that
+        # activation stays FP16 between ops
+        print("\n🔍 Auditing quantize/dequantize placement...")
+        op_counts = count_mil_ops(mlmodel)
+        num_linear = op_counts.get("linear", 0) + op_counts.get("matmul", 0)
+        num_quantize = op_counts.get("quantize", 0)
+        num_dequantize = op_counts.get("dequantize", 0)
+        print(f"   linear/matmul: {num_linear}, quantize: {num_quantize}, dequantize: {num_dequantize}")
+        num_fp16 = count_fp16_dequantize(mlmodel)
+        if num_fp16:
+            print(f"   ⚠️ {num_fp16} dequantize op(s) feed non-linear ops: those activations stay FP16")
+        else:
+            print("   ✅ Every dequantize feeds a linear/matmul")
+    elif args.compression == "palettize":
+        # k-means palettization: the 128k x 768 embedding table clusters well
+        # at 4 bits; linear weights keep 6 bits for accuracy
+        print("\n🗜️  Palettizing weights (embedding 4-bit, linear 6-bit)...")
+        from coremltools.optimize.coreml import (
+            OpPalettizerConfig,
+            OptimizationConfig,
+            palettize_weights,
+        )
+        
+        palettize_config = OptimizationConfig(
+            op_type_configs={
+                "gather": OpPalettizerConfig(mode="kmeans", nbits=4, granularity="per_tensor"),
+                "linear": OpPalettizerConfig(mode="kmeans", nbits=6),
+            }
+        )
+        mlmodel = palettize_weights(mlmodel, config=palettize_config)
+        print("   Weights palettized")
+    else:
+        print("\n🗜️  Compressing weights to int8...")
+        from coremltools.optimize.coreml import (
+            OpLinearQuantizerConfig,
+            OptimizationConfig,
+            linear_quantize_weights,
+        )
+        
+        quant_config = OptimizationConfig(
+            global_config=OpLinearQuantizerConfig(
+                mode="linear_symmetric",
+                dtype="int8",
+                granularity="per_channel",
+            )
+        )
+        mlmodel = linear_quantize_weights(mlmodel, config=quant_config)
+        print("   Weights quantized")
+    
     # Add metadata
     mlmodel.author = "NVIDIA (converted for on-device inference)"
     mlmodel.short_description = (
         "Prompt Task and Complexity Classifier. "
-        "Returns raw logits for 8 classification heads. "
+        "Returns raw logits for 7 classification heads. "
         "Post-processing (softmax, weighted scores) required."
     )
     
-    # Step 7: Save the model
+    # Step 7: Save the model (before validation, so a failing check on an
+    # older macOS never throws away a finished conversion)
     output_filename = "PromptGrader.mlpackage"
     mlmodel.save(output_filename)
+    print(f"\n💾 Saved '{output_filename}'")
+    
+    # Post-processing maps live next to the model, not inside it
+    metadata = {
+        "task_type_map": config.task_type_map,      # Index -> Task name
+        "weights_map": config.weights_map,          # Score computation weights
+        "divisor_map": config.divisor_map,          # Score normalization divisors
+        "target_sizes": config.target_sizes,        # Output sizes per head
+        "output_names": output_names,               # CoreML output tensor names
+        "pruned_heads": list(PRUNED_HEADS),         # Heads not exported
+    }
+    metadata_filename = "classifier_metadata.json"
+    with open(metadata_filename, "w") as f:
+        json.dump(metadata, f, indent=2)
     
-    print(f"\n✅ Success! Saved '{output_filename}'")
+    # Step 8: Validate against PyTorch (CoreML prediction requires macOS)
+    if sys.platform == "darwin":
+        # Check every enumerated length against the PyTorch reference at
+        # max_length: a size baked into the trace (e.g. in DeBERTa's relative
+        # position code) would only show up at the shorter buckets
+        validation_lengths = [max_length] if args.w8a8 else list(SEQUENCE_BUCKETS)
+        sample_length = int(inputs["attention_mask"].sum())
+        with torch.no_grad():
+            torch_outputs = model(inputs["input_ids"], inputs["attention_mask"])
+        for length in validation_lengths:
+            if length < sample_length:
+                continue
+            print(f"\n📊 Comparing PyTorch vs CoreML outputs (S={length})...")
+            coreml_predictions = mlmodel.predict({
+                "input_ids": inputs["input_ids"][:, :length].numpy().astype(np.int32),
+                "attention_mask": inputs["attention_mask"][:, :length].numpy().astype(np.int32),
+            })
+            for name, pt_out in zip(output_names, torch_outputs):
+                psnr = compute_psnr(pt_out.numpy(), coreml_predictions[name])
+                status = "✅" if psnr > 40 else "⚠️"
+                print(f"   {status} {name}: PSNR = {psnr:.1f} dB")
+        
+        # Always score held-out prompts; drop any that a custom W8A8
+        # calibration file also used to set activation ranges
+        prompts = EVALUATION_PROMPTS
+        if args.w8a8 and args.calibration_file:
+            calibration_set = set(load_calibration_prompts(args.calibration_file))
+            prompts = [prompt for prompt in prompts if prompt not in calibration_set]
+        for length in validation_lengths:
+            # Only prompts the app would pad to this bucket (or a shorter one)
+            bucket_prompts = [
+                prompt for prompt in prompts
+                if len(tokenizer(prompt)["input_ids"]) <= length
+            ]
+            if not bucket_prompts:
+                continue
+            print(f"\n🎯 Top-1 agreement on {len(bucket_prompts)} prompts (S={length})...")
+            agreement = top1_agreement(
+                model, mlmodel, tokenizer, bucket_prompts, output_names, max_length,
+                sequence_length=length,
+            )
+            for name in output_names:
+                status = "✅" if agreement[name] >= 0.95 else "⚠️"
+                print(f"   {status} {name}: {agreement[name]:.0%}")
+        
+        print("\n🧠 Checking Neural Engine placement...")
+        try:
+            fallback_ops = report_compute_devices(mlmodel)
+        except Exception as e:
+            # MLComputePlan needs macOS 14.4+ and coremltools 8+
+            print(f"   ⏭️  Skipping Neural Engine report (needs macOS 14.4+, coremltools 8+): {e}")
+        else:
+            if fallback_ops:
+                for op_type, count in sorted(fallback_ops.items()):
+                    print(f"   ⚠️ {op_type}: {count} op(s) not on ANE")
+            else:
+                print("   ✅ All ops placed on the Neural Engine")
+    else:
+        print("\n⏭️  Skipping CoreML validation (requires macOS)")
+    
+    print(f"\n✅ Success! Saved '{output_filename}' and '{metadata_filename}'")
     print("\n📋 Next Steps:")
     print("   1. Copy PromptGrader.mlpackage to your Xcode project")
     print("   2. Copy tokenizer files (tokenizer.json, vocab.txt) to app bundle")
-    print("   3. Implement post-processing in Swift (see PromptRouter.swift)")
+    print("   3. Implement post-processing in Swift (see PromptRouter.swift),")
+    print("      using the maps in classifier_metadata.json")
+    if args.w8a8:
+        print(f"   4. Pad input_ids/attention_mask to {max_length} (W8A8 models have a static shape)")
+    else:
+        print(f"   4. Pad input_ids/attention_mask to the smallest of {list(SEQUENCE_BUCKETS)} "
+              "that fits the prompt")
     print("\n📊 Output Heads:")
     for i, name in enumerate(output_names):
         print(f"   {i}: {name}")
@@ -19,14 +19,21 @@ Classification Heads (8 outputs):
   3. logits_contextual_knowledge- 2 classes (Required, Not Required)
   4. logits_few_shots           - 6 classes (0-5 examples needed)
   5. logits_domain_knowledge    - 4 classes (Expert, Intermediate, Basic, None)
-  6. logits_no_label_reason     - 1 class (internal use)
+  6. logits_no_label_reason     - 1 class (internal use; pruned when weights_map
+                                  gives it zero weight, as in the released config)
   7. logits_constraint_ct       - 2 classes (Has Constraints, No Constraints)
 
 === OUTPUT FILES ===
 
 The script produces the following files in ./onnx_model/:
 
-  model.onnx              - The ONNX model (~700MB)
+  model.onnx              - The ONNX model, static [1, 128] input (~700MB)
+  model_optimized.onnx    - ORT-fused version of model.onnx (ship this one)
+  model_int8.onnx         - Dynamic INT8 quantized model, ~4x smaller (--quantize only)
+  model_dynamic.onnx      - Dynamic batch/sequence variant (--dynamic only)
+  encoder.onnx/heads.onnx - Model split at the pooled features (--split only)
+  model_bf16.onnx         - BFloat16 variant, fp32 logits (--dtype bf16 only)
+                            needs bf16 kernels; stock ORT CPU/wasm cannot run it
   tokenizer.json          - Tokenizer vocabulary and config
   tokenizer_config.json   - Tokenizer settings
   special_tokens_map.json - Special token mappings
@@ -40,13 +47,19 @@ Prerequisites:
 
 Run:
     python onnx_convert.py
+    python onnx_convert.py --verify      # check graph + compare ORT vs PyTorch
+    python onnx_convert.py --quantize    # also export model_int8.onnx
+    python onnx_convert.py --dynamic     # also export model_dynamic.onnx
+    python onnx_convert.py --dtype bf16  # also export model_bf16.onnx
+    python onnx_convert.py --split       # also export encoder.onnx + heads.onnx
+    python onnx_convert.py --aot         # also AOT-compile model.so (TorchInductor)
 
 Output:
     ./onnx_model/  (copy contents to web-app/public/models/)
 
 === WEB DEPLOYMENT ===
 
-1. Copy model.onnx to your web app's public/models/ directory
+1. Copy model_optimized.onnx to your web app's public/models/model.onnx
 2. Copy tokenizer files for @huggingface/transformers
 3. Copy classifier_metadata.json for post-processing weights
 4. Use ONNX Runtime Web for inference (see classifier.js)
@@ -65,7 +78,12 @@ License: Subject to NVIDIA's model license
 """
 
 import os
+import copy
 import json
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+import time
+import numpy as np
 import torch
 import torch.nn as nn
 from transformers import AutoModel, AutoTokenizer, AutoConfig
@@ -85,30 +103,29 @@ class MeanPooling(nn.Module):
     are determined by the attention mask (ignoring padding tokens).
     
     Input:  last_hidden_state [batch, seq_len, hidden_dim]
-            attention_mask [batch, seq_len]
+            attention_mask_float [batch, seq_len] (already in hidden state dtype)
     Output: [batch, hidden_dim]
     """
     
     def __init__(self):
         super(MeanPooling, self).__init__()
 
-    def forward(self, last_hidden_state, attention_mask):
-        # Expand attention mask to hidden dimension
-        # Shape: [batch, seq_len] -> [batch, seq_len, hidden_dim]
-        input_mask_expanded = (
-            attention_mask.unsqueeze(-1).expand(last_hidden_state.size()).float()
-        )
+    def forward(self, last_hidden_state, attention_mask_float):
+        # Mask as [batch, seq_len, 1]: broadcasts over hidden_dim in the
+        # multiply, so no [batch, seq_len, hidden_dim] mask is materialized
+        mask = attention_mask_float.unsqueeze(-1)
         
         # Weighted sum of embeddings (padding tokens contribute 0)
-        sum_embeddings = torch.sum(last_hidden_state * input_mask_expanded, 1)
+        sum_embeddings = (last_hidden_state * mask).sum(dim=1)
         
-        # Count non-padding tokens per sequence
-        sum_mask = input_mask_expanded.sum(1)
-        sum_mask = torch.clamp(sum_mask, min=1e-9)  # Prevent division by zero
+        # Count non-padding tokens per sequence: [batch, 1]
+        sum_mask = attention_mask_float.sum(dim=1, keepdim=True)
+        # Prevent division by zero (smallest normal value of the mask dtype,
+        # so the clamp is representable in bf16 as well as fp32)
+        sum_mask = sum_mask.clamp_(min=torch.finfo(sum_mask.dtype).tiny)
         
         # Compute mean
-        mean_embeddings = sum_embeddings / sum_mask
-        return mean_embeddings
+        return sum_embeddings / sum_mask
 
 
 class MulticlassHead(nn.Module):
@@ -141,19 +158,38 @@ class PromptClassifierONNX(nn.Module):
             ↓
         Mean Pooling [batch, 768]
             ↓
-        8 Classification Heads → 8 Logit Tensors
+        Fused Classification Heads [batch, 31] → split into 7 Logit Tensors
+    
+    Heads named in pruned_heads are loaded (to match the checkpoint) but left
+    out of the fused head and the outputs.
     """
     
-    def __init__(self, config):
+    def __init__(self, config, pruned_heads=()):
         super(PromptClassifierONNX, self).__init__()
         
         # DeBERTa-v3-base: 12 layers, 768 hidden dim, 12 attention heads
-        self.backbone = AutoModel.from_pretrained("microsoft/deberta-v3-base")
+        # Prefer fused scaled_dot_product_attention when the installed
+        # transformers has an SDPA path for DeBERTa-v2; it raises ValueError
+        # otherwise (disentangled attention adds position bias terms that
+        # the stock SDPA kernel does not take), so fall back to eager
+        try:
+            self.backbone = AutoModel.from_pretrained(
+                "microsoft/deberta-v3-base", attn_implementation="sdpa"
+            )
+        except ValueError:
+            print("   SDPA attention not available for DeBERTa-v2, using eager attention")
+            self.backbone = AutoModel.from_pretrained("microsoft/deberta-v3-base")
         
         # Get output sizes for each head from config
         # e.g., {'task_type': 12, 'creativity_scope': 3, ...}
         self.target_sizes = list(config.target_sizes.values())
         
+        # Heads included in the model outputs (indices into target_sizes)
+        self.output_heads = [
+            i for i, name in enumerate(config.target_sizes) if name not in pruned_heads
+        ]
+        self.output_sizes = [self.target_sizes[i] for i in self.output_heads]
+        
         # Create classification heads using ModuleList
         # This produces clean weight keys: heads.0.fc.weight, heads.1.fc.weight, etc.
         self.heads = nn.ModuleList([
@@ -161,44 +197,157 @@ class PromptClassifierONNX(nn.Module):
             for sz in self.target_sizes
         ])
         
+        # All output heads as one [hidden, sum(output_sizes)] Linear: one GEMM
+        # instead of one per head. The per-head modules are kept for weight
+        # loading only.
+        self.fused_head = nn.Linear(
+            self.backbone.config.hidden_size, sum(self.output_sizes)
+        )
+        
         self.pool = MeanPooling()
+    
+    def fuse_heads(self):
+        """
+        Copies the output heads' weights into fused_head.
         
-    def forward(self, input_ids, attention_mask):
+        Must be called after loading pretrained weights (done by
+        load_weights_from_original).
         """
-        Forward pass returning raw logits for all classification heads.
+        output_heads = [self.heads[i] for i in self.output_heads]
+        with torch.no_grad():
+            self.fused_head.weight.copy_(
+                torch.cat([head.fc.weight for head in output_heads], dim=0)
+            )
+            self.fused_head.bias.copy_(
+                torch.cat([head.fc.bias for head in output_heads], dim=0)
+            )
+        
+    def encode(self, input_ids, attention_mask):
+        """
+        Runs the backbone and mean pooling (the expensive part of the model).
         
         Args:
             input_ids: Token IDs [batch, seq_len] (int64)
             attention_mask: Attention mask [batch, seq_len] (int64)
         
         Returns:
-            Tuple of 8 logit tensors:
-                - logits_task_type [batch, 12]
-                - logits_creativity_scope [batch, 3]
-                - logits_reasoning [batch, 2]
-                - logits_contextual_knowledge [batch, 2]
-                - logits_few_shots [batch, 6]
-                - logits_domain_knowledge [batch, 4]
-                - logits_no_label_reason [batch, 1]
-                - logits_constraint_ct [batch, 2]
+            Pooled features [batch, hidden_dim]
         """
-        # Cast attention mask to float for DeBERTa's attention computation
-        attention_mask_float = attention_mask.float()
-        
-        # Get transformer hidden states
+        # Get transformer hidden states (DeBERTa casts the integer mask
+        # internally, so no float mask is kept alive across the 12 layers)
         outputs = self.backbone(
             input_ids=input_ids, 
-            attention_mask=attention_mask_float
+            attention_mask=attention_mask
         )
         last_hidden_state = outputs.last_hidden_state
         
+        # Cast the mask once, for pooling only
+        attention_mask_float = attention_mask.to(last_hidden_state.dtype)
+        
         # Pool sequence to single vector
-        pooled = self.pool(last_hidden_state, attention_mask_float)
+        return self.pool(last_hidden_state, attention_mask_float)
+    
+    def classify(self, pooled):
+        """
+        Applies the fused classification heads to pooled features.
+        
+        Args:
+            pooled: Pooled features [batch, hidden_dim] (output of encode)
         
-        # Get logits from each classification head
-        logits = [head(pooled) for head in self.heads]
+        Returns:
+            Tuple of logit tensors, one per output head (in head order)
+        """
+        # Run all heads at once, then split into per-head logits (in head order).
+        # Logits are always fp32 (a no-op for fp32 models, so nothing is traced)
+        fused = self.fused_head(pooled).float()
+        return tuple(torch.split(fused, self.output_sizes, dim=-1))
+    
+    def forward(self, input_ids, attention_mask):
+        """
+        Forward pass returning raw logits for the output heads.
+        
+        Args:
+            input_ids: Token IDs [batch, seq_len] (int64)
+            attention_mask: Attention mask [batch, seq_len] (int64)
         
-        return tuple(logits)
+        Returns:
+            Tuple of logit tensors (7 with no_label_reason pruned):
+                - logits_task_type [batch, 12]
+                - logits_creativity_scope [batch, 3]
+                - logits_reasoning [batch, 2]
+                - logits_contextual_knowledge [batch, 2]
+                - logits_few_shots [batch, 6]
+                - logits_domain_knowledge [batch, 4]
+                - logits_no_label_reason [batch, 1] (unless pruned)
+                - logits_constraint_ct [batch, 2]
+        """
+        return self.classify(self.encode(input_ids, attention_mask))
+
+
+class EncoderONNX(nn.Module):
+    """
+    Exports PromptClassifierONNX.encode as its own graph (encoder.onnx).
+    
+    Input:  input_ids, attention_mask [batch, seq_len]
+    Output: pooled [batch, hidden_dim]
+    """
+    
+    def __init__(self, model):
+        super(EncoderONNX, self).__init__()
+        self.model = model
+    
+    def forward(self, input_ids, attention_mask):
+        return self.model.encode(input_ids, attention_mask)
+
+
+class HeadsONNX(nn.Module):
+    """
+    Exports PromptClassifierONNX.classify as its own graph (heads.onnx).
+    
+    Input:  pooled [batch, hidden_dim]
+    Output: Tuple of logit tensors, one per output head
+    """
+    
+    def __init__(self, model):
+        super(HeadsONNX, self).__init__()
+        self.model = model
+    
+    def forward(self, pooled):
+        return self.model.classify(pooled)
+
+
+# Padded sequence lengths for variable-length inference with model_dynamic.onnx.
+# Padding each batch to the smallest bucket that fits avoids paying O(S²)
+# attention for padding, while keeping few distinct shapes for ORT to cache.
+SEQUENCE_BUCKETS = (16, 32, 64, 128, 256)
+
+
+def tokenize_bucketed(texts, tokenizer, buckets=SEQUENCE_BUCKETS):
+    """
+    Tokenizes a batch, padding to the smallest bucket that fits its longest text.
+    
+    Args:
+        texts: Prompt string or list of prompt strings
+        tokenizer: Hugging Face tokenizer
+        buckets: Ascending padded lengths; longer texts are truncated to the last
+    
+    Returns:
+        Tokenizer output with input_ids/attention_mask of shape [batch, bucket]
+    """
+    encoded = tokenizer(texts, truncation=True, max_length=buckets[-1])
+    input_ids = encoded["input_ids"]
+    if isinstance(texts, str):
+        input_ids = [input_ids]
+    longest = max(len(ids) for ids in input_ids)
+    bucket = next((b for b in buckets if b >= longest), buckets[-1])
+    
+    return tokenizer(
+        texts,
+        return_tensors="pt",
+        max_length=bucket,
+        padding="max_length",
+        truncation=True
+    )
 
 
 def load_weights_from_original(model, state_dict):
@@ -211,33 +360,38 @@ def load_weights_from_original(model, state_dict):
     Our ModuleList-based model expects:
         heads.0.fc.weight, heads.0.fc.bias, heads.1.fc.weight, ...
     
-    This function renames the keys to match our structure.
+    This function renames the keys to match our structure, then copies
+    the head weights into the model's fused head.
     
     Args:
         model: PromptClassifierONNX instance
-        state_dict: Original model weights
+        state_dict: Original model weights (emptied once the keys are renamed)
     
     Returns:
         Model with loaded weights
     """
-    new_state_dict = {}
-    
-    for key, value in state_dict.items():
-        if key.startswith("head_"):
-            # head_0.fc.weight -> heads.0.fc.weight
-            new_key = key.replace("head_", "heads.")
-            new_state_dict[new_key] = value
-        else:
-            new_state_dict[key] = value
+    # head_0.fc.weight -> heads.0.fc.weight (only the leading prefix is renamed)
+    new_state_dict = {
+        ("heads." + key[len("head_"):] if key.startswith("head_") else key): value
+        for key, value in state_dict.items()
+    }
+    # Drop the original mapping so only one dict references the tensors
+    state_dict.clear()
+    del state_dict
     
-    # Load with strict=False to handle any buffer mismatches
-    missing, unexpected = model.load_state_dict(new_state_dict, strict=False)
+    # Load with strict=False to handle any buffer mismatches. assign=True makes
+    # the checkpoint tensors the parameters (the freshly initialized ones are
+    # freed) instead of copying them, so a memory-mapped .bin stays mmap-backed
+    missing, unexpected = model.load_state_dict(new_state_dict, strict=False, assign=True)
     
+    # fused_head is never in the checkpoint (fuse_heads fills it below)
+    missing = [key for key in missing if not key.startswith("fused_head.")]
     if missing:
-        print(f"   ⚠️ Missing keys (may be expected): {len(missing)} keys")
+        print(f"   ⚠️ Missing keys: {missing}")
     if unexpected:
         print(f"   ⚠️ Unexpected keys: {unexpected}")
     
+    model.fuse_heads()
     return model
 
 
@@ -245,63 +399,122 @@ def main():
     """
     Main conversion pipeline:
     
-    1. Load model configuration from Hugging Face Hub
+    1. Fetch configuration, tokenizer, and weights from Hugging Face Hub (concurrently)
     2. Initialize ONNX-friendly model architecture
     3. Download and load pretrained weights
     4. Test forward pass
-    5. Export to ONNX format
-    6. Verify ONNX model
-    7. Test with ONNX Runtime
-    8. Save tokenizer and metadata files
+    5. Export to ONNX format (plus split encoder/heads with --split)
+    6. Verify ONNX model (--verify)
+    7. Infer shapes and optimize graph with ONNX Runtime
+    8. Test with ONNX Runtime (--verify)
+    9. Quantize to INT8 (--quantize)
+    10. Export BF16 variant (--dtype bf16)
+    11. AOT-compile with TorchInductor (--aot)
+    12. Save tokenizer and metadata files
     """
+    parser = argparse.ArgumentParser(description="Convert prompt classifier to ONNX")
+    parser.add_argument(
+        "--dynamic",
+        action="store_true",
+        help="Also export model_dynamic.onnx with dynamic batch/sequence axes",
+    )
+    parser.add_argument(
+        "--verify",
+        action="store_true",
+        help="Check the ONNX graph and compare ONNX Runtime outputs against PyTorch",
+    )
+    parser.add_argument(
+        "--quantize",
+        action="store_true",
+        help="Also export model_int8.onnx (dynamic INT8 quantization)",
+    )
+    parser.add_argument(
+        "--dtype",
+        choices=["fp32", "bf16"],
+        default="fp32",
+        help="bf16: also export model_bf16.onnx with bfloat16 weights/activations",
+    )
+    parser.add_argument(
+        "--split",
+        action="store_true",
+        help="Also export encoder.onnx + heads.onnx (cache encoder outputs, re-run heads)",
+    )
+    parser.add_argument(
+        "--aot",
+        action="store_true",
+        help="Also AOT-compile model.so with TorchInductor (for Python/C++ servers)",
+    )
+    args = parser.parse_args()
     
     model_id = "nvidia/prompt-task-and-complexity-classifier"
     output_dir = "./onnx_model"
     
+    # Inference only: no autograd anywhere, and one intra-op pool sized to
+    # the machine (no inter-op pool competing for the same cores)
+    torch.set_grad_enabled(False)
+    torch.set_num_threads(os.cpu_count())
+    torch.set_num_interop_threads(1)
+    
     # ==========================================
     # Step 1: Load Configuration
     # ==========================================
-    print(f"📋 Loading config from {model_id}...")
-    config = AutoConfig.from_pretrained(model_id)
+    # Config, tokenizer, and weights are independent downloads: fetch them
+    # concurrently so the wait is the slowest one, not the sum
+    print(f"📋 Loading config, tokenizer, and weights from {model_id}...")
+    with ThreadPoolExecutor(max_workers=3) as executor:
+        config_future = executor.submit(AutoConfig.from_pretrained, model_id)
+        tokenizer_future = executor.submit(AutoTokenizer.from_pretrained, model_id)
+        weights_future = executor.submit(
+            hf_hub_download, repo_id=model_id, filename="model.safetensors"
+        )
+        config = config_future.result()
+        tokenizer = tokenizer_future.result()
+        try:
+            model_file = weights_future.result()
+        except Exception:
+            model_file = None
     
     print("\n📊 Model configuration:")
     print(f"   Target sizes: {config.target_sizes}")
     print(f"   Task types: {len(config.task_type_map)} classes")
     print(f"   Task type map: {config.task_type_map}")
     
+    # no_label_reason is only worth exporting if post-processing weights it;
+    # the released config weights it [0], so it never affects any score
+    pruned_heads = []
+    if not any(config.weights_map.get("no_label_reason", [])):
+        pruned_heads.append("no_label_reason")
+        print("   Pruning head: no_label_reason (zero weight in weights_map)")
+    
     # ==========================================
     # Step 2: Initialize Model
     # ==========================================
     print("\n🔧 Initializing ONNX-friendly model...")
-    model = PromptClassifierONNX(config)
+    model = PromptClassifierONNX(config, pruned_heads=pruned_heads)
     
     # ==========================================
     # Step 3: Download and Load Weights
     # ==========================================
-    print("\n📥 Downloading pretrained weights...")
-    try:
+    print("\n📥 Loading pretrained weights...")
+    if model_file is not None:
         # Prefer safetensors format (faster loading, smaller files)
-        model_file = hf_hub_download(repo_id=model_id, filename="model.safetensors")
         state_dict = load_file(model_file)
         print("   Loaded from model.safetensors")
-    except Exception:
-        # Fall back to PyTorch binary format
+    else:
+        # Fall back to PyTorch binary format (memory-mapped)
         print("   Safetensors not found, trying pytorch_model.bin...")
         model_file = hf_hub_download(repo_id=model_id, filename="pytorch_model.bin")
-        state_dict = torch.load(model_file, map_location="cpu")
+        state_dict = torch.load(model_file, map_location="cpu", mmap=True, weights_only=True)
     
     print("🔄 Loading weights into model...")
     model = load_weights_from_original(model, state_dict)
     model.eval()  # Set to evaluation mode (disables dropout)
     
     # ==========================================
-    # Step 4: Prepare Tokenizer and Test Input
+    # Step 4: Prepare Test Input
     # ==========================================
-    print("\n📝 Loading tokenizer...")
-    tokenizer = AutoTokenizer.from_pretrained(model_id)
-    
-    # Create dummy input for tracing and testing
-    print("🔄 Creating test input...")
+    # Create dummy input for tracing and testing (tokenizer loaded in Step 1)
+    print("\n🔄 Creating test input...")
     dummy_text = "Write a Python function to sort a list."
     inputs = tokenizer(
         dummy_text,
@@ -317,10 +530,36 @@ def main():
     # Step 5: Test Forward Pass
     # ==========================================
     print("\n🧪 Testing PyTorch forward pass...")
-    with torch.no_grad():
-        outputs = model(inputs["input_ids"], inputs["attention_mask"])
-        print(f"   ✅ Forward pass successful")
+    
+    # With --verify, a compiled copy (specialized to the static [1, 128]
+    # input) runs the PyTorch reference passes. Otherwise the eager model is
+    # used, so the default path needs no Inductor compile or C++ toolchain.
+    # The plain model is always used for ONNX export (compiled modules do
+    # not export cleanly).
+    if args.verify:
+        reference_model = torch.compile(model, mode="reduce-overhead", dynamic=False, fullgraph=False)
+    else:
+        reference_model = model
+    
+    with torch.inference_mode():
+        # Warm-up call (triggers compilation if compiled); the second call is representative
+        reference_model(inputs["input_ids"], inputs["attention_mask"])
+        start_time = time.perf_counter()
+        outputs = reference_model(inputs["input_ids"], inputs["attention_mask"])
+        elapsed_ms = (time.perf_counter() - start_time) * 1000
+        print(f"   ✅ Forward pass successful ({elapsed_ms:.1f} ms)")
         print(f"   Output shapes: {[o.shape for o in outputs]}")
+        
+        # Same prompt padded to its bucket instead of 128: predictions should match
+        bucketed_inputs = tokenize_bucketed(dummy_text, tokenizer)
+        bucketed_outputs = model(bucketed_inputs["input_ids"], bucketed_inputs["attention_mask"])
+        bucket_len = bucketed_inputs["input_ids"].shape[1]
+        same_argmax = all(
+            torch.equal(full.argmax(dim=-1), short.argmax(dim=-1))
+            for full, short in zip(outputs, bucketed_outputs)
+        )
+        status = "✅" if same_argmax else "⚠️"
+        print(f"   {status} Bucketed input (S={bucket_len}) argmax matches S=128: {same_argmax}")
     
     # ==========================================
     # Step 6: Export to ONNX
@@ -342,16 +581,11 @@ def main():
         "logits_no_label_reason",     # 1 class
         "logits_constraint_ct"        # 2 classes
     ]
+    if "no_label_reason" in pruned_heads:
+        output_names.remove("logits_no_label_reason")
     
-    # Dynamic axes allow variable batch size and sequence length
-    # This enables batched inference and different prompt lengths
-    dynamic_axes = {
-        "input_ids": {0: "batch_size", 1: "sequence_length"},
-        "attention_mask": {0: "batch_size", 1: "sequence_length"},
-    }
-    for name in output_names:
-        dynamic_axes[name] = {0: "batch_size"}
-    
+    # Static [1, 128] shapes (the web app always pads to 128): lets constant
+    # folding and ORT pick shape-specialized kernels.
     # Export using legacy TorchScript-based exporter
     # (dynamo=False is faster and more stable for transformer models)
     torch.onnx.export(
@@ -360,66 +594,284 @@ def main():
         onnx_path,
         input_names=input_names,
         output_names=output_names,
-        dynamic_axes=dynamic_axes,
-        opset_version=14,           # ONNX opset 14 for broad compatibility
+        opset_version=17,           # ONNX opset 17 (native LayerNormalization)
         do_constant_folding=True,   # Optimize constant expressions
         dynamo=False,               # Use legacy exporter (faster, more stable)
     )
     
     print(f"   ✅ ONNX model saved to: {onnx_path}")
     
+    if args.dynamic:
+        # Dynamic axes allow variable batch size and sequence length
+        # This enables batched inference and different prompt lengths
+        dynamic_axes = {
+            "input_ids": {0: "batch_size", 1: "sequence_length"},
+            "attention_mask": {0: "batch_size", 1: "sequence_length"},
+        }
+        for name in output_names:
+            dynamic_axes[name] = {0: "batch_size"}
+        
+        dynamic_onnx_path = os.path.join(output_dir, "model_dynamic.onnx")
+        torch.onnx.export(
+            model,
+            (inputs["input_ids"], inputs["attention_mask"]),
+            dynamic_onnx_path,
+            input_names=input_names,
+            output_names=output_names,
+            dynamic_axes=dynamic_axes,
+            opset_version=17,
+            do_constant_folding=True,
+            dynamo=False,
+        )
+        
+        print(f"   ✅ Dynamic-shape ONNX model saved to: {dynamic_onnx_path}")
+    
+    if args.split:
+        # Split export: the encoder (12 DeBERTa layers + pooling) and the heads
+        # as separate graphs, so a caller can cache the pooled features for a
+        # prompt and re-run only the heads when re-scoring it
+        encoder_path = os.path.join(output_dir, "encoder.onnx")
+        torch.onnx.export(
+            EncoderONNX(model),
+            (inputs["input_ids"], inputs["attention_mask"]),
+            encoder_path,
+            input_names=input_names,
+            output_names=["pooled"],
+            opset_version=17,
+            do_constant_folding=True,
+            dynamo=False,
+        )
+        
+        heads_path = os.path.join(output_dir, "heads.onnx")
+        # Plain tensor (not inference_mode) so it can be traced as an input
+        pooled = model.encode(inputs["input_ids"], inputs["attention_mask"])
+        torch.onnx.export(
+            HeadsONNX(model),
+            (pooled,),
+            heads_path,
+            input_names=["pooled"],
+            output_names=output_names,
+            opset_version=17,
+            do_constant_folding=True,
+            dynamo=False,
+        )
+        
+        print(f"   ✅ Encoder saved to: {encoder_path}")
+        print(f"   ✅ Heads saved to: {heads_path}")
+    
     # ==========================================
-    # Step 7: Verify ONNX Model
+    # Step 7: Verify ONNX Model (--verify)
     # ==========================================
-    print("\n🔍 Verifying ONNX model...")
-    import onnx
-    onnx_model = onnx.load(onnx_path)
-    onnx.checker.check_model(onnx_model)
-    print("   ✅ ONNX model is valid!")
+    if args.verify:
+        print("\n🔍 Verifying ONNX model...")
+        import onnx
+        onnx_model = onnx.load(onnx_path)
+        onnx.checker.check_model(onnx_model)
+        print("   ✅ ONNX model is valid!")
     
     # ==========================================
-    # Step 8: Test with ONNX Runtime
+    # Step 8: Infer Shapes and Optimize Graph with ONNX Runtime
     # ==========================================
-    print("\n🧪 Testing with ONNX Runtime...")
+    print("\n⚙️  Optimizing ONNX graph...")
+    import onnx
+    from onnx import shape_inference
     import onnxruntime as ort
     
-    # Create inference session
-    session = ort.InferenceSession(onnx_path)
+    # Annotate every intermediate tensor with its (static) shape so ORT's
+    # fusers can match patterns that need concrete dimensions
+    inferred_model = shape_inference.infer_shapes(onnx.load(onnx_path))
+    onnx.save(inferred_model, onnx_path)
+    del inferred_model
+    print("   ✅ Shape inference applied")
+    
+    # Persist the fused graph for shipping. EXTENDED rather than ALL: the
+    # ALL level adds CPU memory-layout transforms that tie the saved file
+    # to this machine, which would break it in ORT Web
+    optimized_onnx_path = os.path.join(output_dir, "model_optimized.onnx")
+    export_options = ort.SessionOptions()
+    export_options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_EXTENDED
+    export_options.optimized_model_filepath = optimized_onnx_path
+    ort.InferenceSession(onnx_path, export_options, providers=["CPUExecutionProvider"])
+    print(f"   ✅ Optimized ONNX model saved to: {optimized_onnx_path}")
     
-    # Prepare inputs (ONNX Runtime expects numpy arrays)
-    ort_inputs = {
-        "input_ids": inputs["input_ids"].numpy(),
-        "attention_mask": inputs["attention_mask"].numpy()
-    }
+    # ==========================================
+    # Step 9: Test with ONNX Runtime (--verify)
+    # ==========================================
+    if args.verify:
+        print("\n🧪 Testing with ONNX Runtime...")
+        
+        # Run the file that actually ships (model_optimized.onnx); ALL on top
+        # only adds in-memory CPU layout transforms, as any runtime would
+        sess_options = ort.SessionOptions()
+        sess_options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        sess_options.intra_op_num_threads = os.cpu_count()
+        session = ort.InferenceSession(
+            optimized_onnx_path, sess_options, providers=["CPUExecutionProvider"]
+        )
+        
+        # Prepare inputs (ONNX Runtime expects numpy arrays)
+        ort_inputs = {
+            "input_ids": inputs["input_ids"].numpy(),
+            "attention_mask": inputs["attention_mask"].numpy()
+        }
+        
+        # Bind inputs and preallocated output buffers once, so repeated runs
+        # (e.g. while iterating on quantization settings) skip per-call
+        # allocation and copies; ORT writes logits straight into ort_outputs
+        ort_outputs = [np.empty((1, size), dtype=np.float32) for size in model.output_sizes]
+        io_binding = session.io_binding()
+        io_binding.bind_cpu_input("input_ids", ort_inputs["input_ids"])
+        io_binding.bind_cpu_input("attention_mask", ort_inputs["attention_mask"])
+        for name, buffer in zip(output_names, ort_outputs):
+            io_binding.bind_output(
+                name,
+                "cpu",
+                element_type=np.float32,
+                shape=buffer.shape,
+                buffer_ptr=buffer.ctypes.data,
+            )
+        
+        # Run inference (first run warms up the session's memory plan)
+        session.run_with_iobinding(io_binding)
+        session.run_with_iobinding(io_binding)
+        
+        print("   ✅ ONNX Runtime inference successful!")
+        print(f"   Output shapes: {[o.shape for o in ort_outputs]}")
+        
+        # Compare PyTorch vs ONNX outputs (should be nearly identical)
+        print("\n📊 Comparing PyTorch vs optimized ONNX outputs...")
+        for i, (pt_out, ort_out) in enumerate(zip(outputs, ort_outputs)):
+            diff = abs(pt_out.numpy() - ort_out).max()
+            status = "✅" if diff < 1e-4 else "⚠️"
+            print(f"   {status} {output_names[i]}: max diff = {diff:.6f}")
+        
+        if args.split:
+            # heads(encoder(x)) must reproduce the end-to-end graph
+            encoder_session = ort.InferenceSession(
+                encoder_path, sess_options, providers=["CPUExecutionProvider"]
+            )
+            heads_session = ort.InferenceSession(
+                heads_path, sess_options, providers=["CPUExecutionProvider"]
+            )
+            (ort_pooled,) = encoder_session.run(None, ort_inputs)
+            split_outputs = heads_session.run(None, {"pooled": ort_pooled})
+            
+            print("\n📊 Comparing model.onnx vs encoder.onnx + heads.onnx outputs...")
+            for i, (full_out, split_out) in enumerate(zip(ort_outputs, split_outputs)):
+                diff = abs(full_out - split_out).max()
+                status = "✅" if diff < 1e-4 else "⚠️"
+                print(f"   {status} {output_names[i]}: max diff = {diff:.6f}")
     
-    # Run inference
-    ort_outputs = session.run(None, ort_inputs)
+    # ==========================================
+    # Step 10: Quantize to INT8 (--quantize)
+    # ==========================================
+    if args.quantize:
+        print("\n🗜️  Quantizing to INT8 (dynamic)...")
+        from onnxruntime.quantization import quantize_dynamic, QuantType
+        
+        # Int8 weights for the MatMuls and the embedding Gather (most of the
+        # file size); activations are quantized on the fly at runtime
+        int8_onnx_path = os.path.join(output_dir, "model_int8.onnx")
+        quantize_dynamic(
+            onnx_path,
+            int8_onnx_path,
+            weight_type=QuantType.QInt8,
+            op_types_to_quantize=["MatMul", "Gather"],
+        )
+        print(f"   ✅ INT8 model saved to: {int8_onnx_path}")
+        
+        if args.verify:
+            int8_session = ort.InferenceSession(
+                int8_onnx_path, sess_options, providers=["CPUExecutionProvider"]
+            )
+            int8_outputs = int8_session.run(None, ort_inputs)
+            
+            # Quantization is lossy: use a looser tolerance than the FP32 check
+            print("\n📊 Comparing PyTorch vs INT8 ONNX outputs...")
+            for i, (pt_out, int8_out) in enumerate(zip(outputs, int8_outputs)):
+                diff = abs(pt_out.numpy() - int8_out).max()
+                status = "✅" if diff < 5e-2 else "⚠️"
+                print(f"   {status} {output_names[i]}: max diff = {diff:.6f}")
     
-    print("   ✅ ONNX Runtime inference successful!")
-    print(f"   Output shapes: {[o.shape for o in ort_outputs]}")
+    # ==========================================
+    # Step 11: BF16 Export (--dtype bf16)
+    # ==========================================
+    if args.dtype == "bf16":
+        print("\n🔄 Exporting BF16 model...")
+        # Separate copy so the fp32 model stays the reference
+        bf16_model = copy.deepcopy(model).to(torch.bfloat16)
+        
+        # input_ids and attention_mask stay int64; same static shape as model.onnx
+        bf16_onnx_path = os.path.join(output_dir, "model_bf16.onnx")
+        torch.onnx.export(
+            bf16_model,
+            (inputs["input_ids"], inputs["attention_mask"]),
+            bf16_onnx_path,
+            input_names=input_names,
+            output_names=output_names,
+            opset_version=17,
+            do_constant_folding=True,
+            dynamo=False,
+        )
+        print(f"   ✅ BF16 model saved to: {bf16_onnx_path}")
+        
+        if args.verify:
+            # Stock onnxruntime CPU (and the web app's wasm backend) has no
+            # bfloat16 MatMul/Add/LayerNormalization kernels, so the ONNX file
+            # cannot be run here; check the bf16 weights in PyTorch instead
+            with torch.inference_mode():
+                bf16_outputs = bf16_model(inputs["input_ids"], inputs["attention_mask"])
+            
+            print("\n📊 Comparing FP32 vs BF16 PyTorch outputs...")
+            for i, (fp32_out, bf16_out) in enumerate(zip(outputs, bf16_outputs)):
+                diff = (fp32_out - bf16_out).abs().max().item()
+                status = "✅" if diff < 5e-3 else "⚠️"
+                print(f"   {status} {output_names[i]}: max diff = {diff:.6f}")
     
-    # Compare PyTorch vs ONNX outputs (should be nearly identical)
-    print("\n📊 Comparing PyTorch vs ONNX outputs...")
-    for i, (pt_out, ort_out) in enumerate(zip(outputs, ort_outputs)):
-        diff = abs(pt_out.numpy() - ort_out).max()
-        status = "✅" if diff < 1e-4 else "⚠️"
-        print(f"   {status} {output_names[i]}: max diff = {diff:.6f}")
+    # ==========================================
+    # Step 12: AOT Compile with TorchInductor (--aot)
+    # ==========================================
+    if args.aot:
+        print("\n🔄 AOT-compiling with TorchInductor...")
+        from torch.export import export
+        
+        # Specialized to the static [1, 128] input, like model.onnx; the
+        # resulting shared library runs without Python dispatch overhead
+        example_inputs = (inputs["input_ids"], inputs["attention_mask"])
+        exported_program = export(model, example_inputs)
+        aot_path = torch._inductor.aot_compile(
+            exported_program.module(),
+            example_inputs,
+            options={"aot_inductor.output_path": os.path.join(output_dir, "model.so")},
+        )
+        print(f"   ✅ AOT-compiled model saved to: {aot_path}")
+        
+        if args.verify:
+            aot_model = torch._export.aot_load(aot_path, "cpu")
+            with torch.inference_mode():
+                aot_outputs = aot_model(*example_inputs)
+            
+            print("\n📊 Comparing PyTorch vs AOT-compiled outputs...")
+            for i, (pt_out, aot_out) in enumerate(zip(outputs, aot_outputs)):
+                diff = (pt_out - aot_out).abs().max().item()
+                status = "✅" if diff < 1e-4 else "⚠️"
+                print(f"   {status} {output_names[i]}: max diff = {diff:.6f}")
     
     # ==========================================
-    # Step 9: Save Tokenizer Files
+    # Step 13: Save Tokenizer Files
     # ==========================================
     print("\n💾 Saving tokenizer files...")
     tokenizer.save_pretrained(output_dir)
     print(f"   Saved to {output_dir}/")
     
     # ==========================================
-    # Step 10: Save Model Config
+    # Step 14: Save Model Config
     # ==========================================
     print("💾 Saving model config...")
     config.save_pretrained(output_dir)
     
     # ==========================================
-    # Step 11: Create Metadata File for Web App
+    # Step 15: Create Metadata File for Web App
     # ==========================================
     print("💾 Creating classifier metadata...")
     
@@ -429,8 +881,55 @@ def main():
         "weights_map": config.weights_map,          # Score computation weights
         "divisor_map": config.divisor_map,          # Score normalization divisors
         "target_sizes": config.target_sizes,        # Output sizes per head
-        "output_names": output_names                # ONNX output tensor names
+        "output_names": output_names,               # ONNX output tensor names
+        "pruned_heads": pruned_heads,               # Heads not exported
+        # Pad lengths for model_dynamic.onnx (see tokenize_bucketed)
+        "sequence_buckets": list(SEQUENCE_BUCKETS),
+        # Shape policy per exported file
+        "model_files": {
+            "model.onnx": {"input_shape": list(inputs["input_ids"].shape), "dynamic": False},
+            # Ship this one as web-app/public/models/model.onnx
+            "model_optimized.onnx": {
+                "input_shape": list(inputs["input_ids"].shape),
+                "dynamic": False,
+            },
+        },
     }
+    if args.quantize:
+        metadata["model_files"]["model_int8.onnx"] = {
+            "input_shape": list(inputs["input_ids"].shape),
+            "dynamic": False,
+            "dtype": "int8",
+        }
+    if args.split:
+        metadata["model_files"]["encoder.onnx"] = {
+            "input_shape": list(inputs["input_ids"].shape),
+            "dynamic": False,
+            "outputs": ["pooled"],
+        }
+        metadata["model_files"]["heads.onnx"] = {
+            "input_shape": list(pooled.shape),
+            "dynamic": False,
+            "inputs": ["pooled"],
+        }
+    if args.dtype == "bf16":
+        metadata["model_files"]["model_bf16.onnx"] = {
+            "input_shape": list(inputs["input_ids"].shape),
+            "dynamic": False,
+            "dtype": "bfloat16",
+        }
+    if args.aot:
+        # Server-side (CPython / libtorch) artifact; the web app uses model.onnx
+        metadata["model_files"]["model.so"] = {
+            "input_shape": list(inputs["input_ids"].shape),
+            "dynamic": False,
+            "runtime": "torch-aot-inductor",
+        }
+    if args.dynamic:
+        metadata["model_files"]["model_dynamic.onnx"] = {
+            "input_shape": ["batch_size", "sequence_length"],
+            "dynamic": True,
+        }
     
     metadata_path = os.path.join(output_dir, "classifier_metadata.json")
     with open(metadata_path, "w") as f:
@@ -451,13 +950,13 @@ def main():
     
     print("\n✅ Conversion complete!")
     print(f"\n📋 Next Steps:")
-    print(f"   1. Copy {output_dir}/model.onnx to web-app/public/models/")
+    print(f"   1. Copy {output_dir}/model_optimized.onnx to web-app/public/models/model.onnx")
     print(f"   2. Copy tokenizer files to web-app/public/models/")
     print(f"   3. Copy classifier_metadata.json to web-app/public/models/")
     print(f"   4. Update classifier.js to load from these paths")
     print(f"\n📊 Output Heads:")
     for i, name in enumerate(output_names):
-        size = list(config.target_sizes.values())[i]
+        size = model.output_sizes[i]
         print(f"   {i}: {name} ({size} classes)")
 
 